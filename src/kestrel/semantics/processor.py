@@ -1,5 +1,4 @@
 import logging
-import re
 
 from kestrel.syntax.utils import get_all_input_var_names, timedelta_seconds
 from kestrel.syntax.reference import deref_and_flatten_value_to_list
@@ -19,6 +18,12 @@ from kestrel.semantics.reference import make_deref_func, make_var_timerange_func
 
 _logger = logging.getLogger(__name__)
 
+_REF_KEYS = frozenset(stix_2_0_ref_mapping)
+_GENERIC_RELATIONS = frozenset(generic_relations)
+
+_CMDS_ASSIGN_DISP = frozenset({"assign", "disp"})
+_CMDS_GET_FIND = frozenset({"get", "find"})
+
 
 def semantics_processing(
     stmt: dict,
@@ -31,71 +36,86 @@ def semantics_processing(
 
     _check_elements_not_empty(stmt)
 
-    for input_var_name in get_all_input_var_names(stmt):
-        _check_var_exists(input_var_name, symtable)
+    cmd = stmt["command"]
 
-    if stmt["command"] == "get":
-        _process_datasource_in_get(stmt, symtable, data_source_manager)
+    missing_vars = [v for v in get_all_input_var_names(stmt) if v not in symtable]
+    if missing_vars:
+        raise VariableNotExist(missing_vars[0])
 
-    if stmt["command"] == "find":
-        _check_semantics_on_find(stmt, symtable[stmt["input"]].type)
+    input_var_name = stmt.get("input")
+    input_var = symtable[input_var_name] if input_var_name is not None else None
+
+    if cmd == "get":
+        _process_datasource_in_get(stmt, symtable, data_source_manager)
+    elif cmd == "find":
+        _check_semantics_on_find(stmt, input_var.type)
 
     if "attrs" in stmt:
-        var_struct = symtable[stmt["input"]]
-        stmt["attrs"] = _normalize_attrs(stmt, var_struct)
+        stmt["attrs"] = _normalize_attrs(stmt, input_var)
 
-    deref_func = make_deref_func(store, symtable)
-    get_timerange_func = make_var_timerange_func(store, symtable)
+    where = stmt.get("where")
+    arguments = stmt.get("arguments")
 
-    if "where" in stmt:
+    if where is not None or arguments is not None:
+        deref_func, get_timerange_func = _get_deref_funcs(store, symtable)
+
+    if where is not None:
 
         # 1. deref()
-        stmt["where"].deref(deref_func, get_timerange_func)
+        where.deref(deref_func, get_timerange_func)
 
         # 2. add_center_entity()
-        if stmt["command"] in ("assign", "disp"):
-            center_entity_type = symtable[stmt["input"]].type
-        elif stmt["command"] in ("get", "find"):
-            center_entity_type = stmt["type"]
-
-        stmt["where"].add_center_entity(center_entity_type)
-
         # 3. to_stix() / to_firepit()
-        if stmt["command"] in ("assign", "disp"):
-            stmt["where"] = stmt["where"].to_firepit()
-        elif stmt["command"] in ("get", "find"):
-            time_adj = tuple(
-                map(
-                    timedelta_seconds,
-                    (
-                        config["stixquery"]["timerange_start_offset"],
-                        config["stixquery"]["timerange_stop_offset"],
-                    ),
-                )
+        if cmd in _CMDS_ASSIGN_DISP:
+            where.add_center_entity(input_var.type)
+            stmt["where"] = where.to_firepit()
+        elif cmd in _CMDS_GET_FIND:
+            where.add_center_entity(stmt["type"])
+            stixquery_config = config["stixquery"]
+            time_adj = (
+                timedelta_seconds(stixquery_config["timerange_start_offset"]),
+                timedelta_seconds(stixquery_config["timerange_stop_offset"]),
             )
-            stmt["stixpattern"] = stmt["where"].to_stix(stmt["timerange"], time_adj)
-
-    if "arguments" in stmt:
-        stmt["arguments"] = {
-            k: _arguments_deref_and_tostring(v, deref_func, get_timerange_func)
-            for k, v in stmt["arguments"].items()
-        }
+            stmt["stixpattern"] = where.to_stix(stmt["timerange"], time_adj)
+
+    if arguments is not None:
+        for k, v in arguments.items():
+            # plain strings are already in final form: no reference, no cast
+            if not isinstance(v, str):
+                arguments[k] = _arguments_deref_and_tostring(
+                    v, deref_func, get_timerange_func
+                )
 
 
-def _check_elements_not_empty(stmt):
-    for k, v in stmt.items():
-        if isinstance(v, str) and not v:
-            raise KestrelInternalError(f'incomplete parser; empty value for "{k}"')
+def _get_deref_funcs(store, symtable):
+    return symtable.get_deref_funcs(
+        store,
+        lambda: (
+            make_deref_func(store, symtable),
+            make_var_timerange_func(store, symtable),
+        ),
+    )
 
 
-def _check_var_exists(var_name, symtable):
-    if var_name not in symtable:
-        raise VariableNotExist(var_name)
+def _check_elements_not_empty(stmt):
+    empty_key = next((k for k, v in stmt.items() if isinstance(v, str) and not v), None)
+    if empty_key is not None:
+        raise KestrelInternalError(f'incomplete parser; empty value for "{empty_key}"')
 
 
 def _normalize_attrs(stmt, v):
+    # whitespace around the comma separators is stripped
+    attrs = stmt["attrs"]
+    if ":" not in attrs:
+        # no entity type prefix to check: bare attributes only
+        # same whitespace as str.strip() in the slow path
+        if attrs.split() == [attrs]:
+            # nothing to strip either: keep the original string
+            return attrs
+        return ",".join(attr.strip() for attr in attrs.split(","))
     props = []
-    for attr in re.split(r",\s*", stmt["attrs"]):
+    for attr in attrs.split(","):
+        attr = attr.strip()
         entity_type, _, prop = attr.rpartition(":")
         if entity_type and entity_type != v.type:
             raise InvalidAttribute(attr)
@@ -104,21 +124,18 @@ def _normalize_attrs(stmt, v):
 
 
 def _process_datasource_in_get(stmt, symtable, data_source_manager):
-
-    if stmt["command"] != "get":
-        return
-
+    # only call on a GET statement
     # parser doesn't understand whether a data source is a Kestrel var
     # this function differente a Kestrel variable source from a data source
-    if "datasource" in stmt:
-        source = stmt["datasource"]
+    source = stmt.get("datasource")
+    if source is not None:
         if source in symtable:
             stmt["variablesource"] = source
             del stmt["datasource"]
 
     # complete default data source
-    last_ds = data_source_manager.queried_data_sources[-1]
     if "variablesource" not in stmt and "datasource" not in stmt:
+        last_ds = data_source_manager.queried_data_sources[-1]
         if last_ds:
             stmt["datasource"] = last_ds
         else:
@@ -126,9 +143,7 @@ def _process_datasource_in_get(stmt, symtable, data_source_manager):
 
 
 def _check_semantics_on_find(stmt, input_type):
-
-    if stmt["command"] != "find":
-        return
+    # only call on a FIND statement
 
     # relation should be in lowercase after parsing by kestrel.syntax.parser.parse_kestrel()
     relation = stmt["relation"]
@@ -142,7 +157,7 @@ def _check_semantics_on_find(stmt, input_type):
         entity_x,
         relation,
         entity_y,
-    ) not in stix_2_0_ref_mapping and relation not in generic_relations:
+    ) not in _REF_KEYS and relation not in _GENERIC_RELATIONS:
         raise UnsupportedRelation(entity_x, relation, entity_y)
 
 
@@ -50,22 +50,25 @@ import os
 import getpass
 import pathlib
 import shutil
+import stat
+import sys
 import uuid
 import logging
 import re
 import time
-import math
 import lark
-import atexit
+import weakref
+import functools
 from datetime import datetime
 from contextlib import AbstractContextManager
+from concurrent.futures import ThreadPoolExecutor
 
 from kestrel.exceptions import (
     KestrelSyntaxError,
     InvalidStixPattern,
     DebugCacheLinkOccupied,
 )
-from kestrel.syntax.parser import parse_kestrel
+from kestrel.syntax.parser import parse_kestrel, parse_kestrel_interactive
 from kestrel.syntax.utils import (
     get_entity_types,
     get_keywords,
@@ -80,6 +83,7 @@ from kestrel.codegen.display import DisplayBlockSummary
 from kestrel.codegen.summary import gen_variable_summary
 from kestrel.symboltable.symtable import SymbolTable
 from firepit import get_storage
+from firepit.sqlitestorage import SQLiteStorage
 from firepit.exceptions import StixPatternError
 from kestrel.utils import set_current_working_directory, resolve_path_in_kestrel_env_var
 from kestrel.config import load_config
@@ -88,6 +92,124 @@ from kestrel.analytics import AnalyticsManager
 
 _logger = logging.getLogger(__name__)
 
+# command name -> execution function in kestrel.codegen.commands
+_CMD_TABLE = {
+    cmd: getattr(commands, cmd)
+    for cmd in (
+        "apply",
+        "assign",
+        "disp",
+        "find",
+        "get",
+        "group",
+        "info",
+        "join",
+        "load",
+        "merge",
+        "new",
+        "save",
+        "sort",
+    )
+}
+
+# a (partial) ISO timestamp with one group per component
+_ISO_TS_RE = re.compile(
+    r"(\d{4})(?:-(\d{2})(?:-(\d{2})(?:T(\d{2})(?::(\d{2})(?::(\d{2})Z?)?)?)?)?)?"
+)
+# values of the components absent in a partial timestamp
+_TS_DEFAULTS = (1, 1, 1, 0, 0, 0)
+
+
+@functools.lru_cache(maxsize=1)
+def _get_keywords_lower():
+    # {keyword: lowercase keyword} for all keywords in both cases
+    return {k: k.lower() for k in get_keywords()}
+
+
+@functools.lru_cache(maxsize=1)
+def _get_user_suffix():
+    # the user does not change in a process: look it up only once
+    # getpass.getuser() first to keep the documented debug path kestrel-$USER
+    for f in (getpass.getuser, os.getuid):
+        try:
+            user_suffix = f()
+        except:
+            continue
+        if user_suffix is not None and user_suffix != "":
+            return str(user_suffix)
+    return "noUID"
+
+
+def _close_session(
+    store,
+    runtime_directory,
+    debug_mode,
+    runtime_directory_is_owned_by_upper_layer,
+    config,
+):
+    # do not hold a reference to the session: this is its finalizer
+
+    # release resources
+    store.close()
+
+    # manage temp folder for debug
+    if not runtime_directory_is_owned_by_upper_layer:
+        if debug_mode:
+            _leave_exit_marker(runtime_directory, config)
+            _remove_obsolete_debug_folders(config)
+        else:
+            shutil.rmtree(runtime_directory)
+
+
+def _leave_exit_marker(runtime_directory, config):
+    exit_marker = os.path.join(
+        runtime_directory, config["debug"]["session_exit_marker"]
+    )
+    with open(exit_marker, "w"):
+        pass
+
+
+def _remove_obsolete_debug_folders(config):
+    # will only clean debug cache directories under system temp directory
+
+    # [(cache_dir, timestamp)]
+    exited_sessions = []
+
+    debug_config = config["debug"]
+    session_dir_prefix = (
+        config["session"]["cache_directory_prefix"] + str(os.getuid()) + "-"
+    )
+    exit_marker = debug_config["session_exit_marker"]
+
+    with os.scandir(tempfile.gettempdir()) as entries:
+        for entry in entries:
+            # cheap name check first; is_dir() is from readdir on most systems
+            if entry.name.startswith(session_dir_prefix) and entry.is_dir(
+                follow_symlinks=False
+            ):
+                try:
+                    marker_stat = os.stat(os.path.join(entry.path, exit_marker))
+                except OSError:
+                    continue
+                exited_sessions.append((entry.path, marker_stat.st_mtime))
+
+    # preserve the newest debug_config["maximum_exited_session"] debug sessions
+    exited_sessions.sort(key=lambda x: x[1])
+    obsolete_dirs = [
+        x for x, _ in exited_sessions[: -debug_config["maximum_exited_session"]]
+    ]
+    if obsolete_dirs:
+        # rmtree is I/O bound (GIL released in syscalls): delete concurrently
+        # a folder may be removed by another exiting session at the same time
+        rmtree = functools.partial(shutil.rmtree, ignore_errors=True)
+        try:
+            with ThreadPoolExecutor(max_workers=min(4, len(obsolete_dirs))) as ex:
+                list(ex.map(rmtree, obsolete_dirs))
+        except RuntimeError:
+            # no new threads at interpreter shutdown, e.g., close() at exit
+            for x in obsolete_dirs:
+                rmtree(x)
+
 
 class Session(AbstractContextManager):
     """Kestrel Session class
@@ -198,10 +320,12 @@ class Session(AbstractContextManager):
         # runtime (temporary) directory to store session-related data
         sys_tmp_dir = pathlib.Path(tempfile.gettempdir())
         if runtime_dir:
-            if os.path.exists(runtime_dir):
-                self.runtime_directory_is_owned_by_upper_layer = True
-            else:
+            try:
+                os.stat(runtime_dir)
+            except FileNotFoundError:
                 pathlib.Path(runtime_dir).mkdir(parents=True, exist_ok=True)
+            else:
+                self.runtime_directory_is_owned_by_upper_layer = True
             self.runtime_directory = runtime_dir
         else:
             tmp_dir = sys_tmp_dir / (
@@ -211,17 +335,21 @@ class Session(AbstractContextManager):
                 + self.session_id
             )
             self.runtime_directory = tmp_dir.expanduser().resolve()
-            if tmp_dir.exists():
-                if tmp_dir.is_dir():
-                    _logger.debug(
-                        "Kestrel session with runtime_directory exists, reuse it."
-                    )
-                else:
+            # one stat() to tell apart: missing, directory, other file
+            try:
+                tmp_dir_mode = os.stat(tmp_dir).st_mode
+            except FileNotFoundError:
+                tmp_dir_mode = None
+            if tmp_dir_mode is not None and stat.S_ISDIR(tmp_dir_mode):
+                _logger.debug(
+                    "Kestrel session with runtime_directory exists, reuse it."
+                )
+            else:
+                if tmp_dir_mode is not None:
                     _logger.debug(
                         "strange tmp file that uses kestrel session dir name, remove it."
                     )
                     os.remove(self.runtime_directory)
-            else:
                 _logger.debug(
                     f"create new session runtime_directory: {self.runtime_directory}."
                 )
@@ -239,6 +367,8 @@ class Session(AbstractContextManager):
             else:
                 store_path = os.path.join(self.runtime_directory, local_database_path)
         self.store = get_storage(store_path, self.session_id)
+        if isinstance(self.store, SQLiteStorage):
+            self._tune_sqlite_store()
 
         # Symbol Table
         # linking variables in syntax with internal data structure
@@ -248,10 +378,18 @@ class Session(AbstractContextManager):
 
         self.data_source_manager = DataSourceManager(self.config)
         self.analytics_manager = AnalyticsManager(self.config)
-        iso_ts_regex = r"\d{4}(-\d{2}(-\d{2}(T\d{2}(:\d{2}(:\d{2}Z?)?)?)?)?)?"
-        self._iso_ts = re.compile(iso_ts_regex)
 
-        atexit.register(self.close)
+        # a finalizer does not keep the session alive as atexit.register() does
+        # it is called by close(), at garbage collection, or at program exit
+        self._finalizer = weakref.finalize(
+            self,
+            _close_session,
+            self.store,
+            self.runtime_directory,
+            self.debug_mode,
+            self.runtime_directory_is_owned_by_upper_layer,
+            self.config,
+        )
 
     def execute(self, codeblock):
         """Execute a Kestrel code block.
@@ -375,8 +513,7 @@ class Session(AbstractContextManager):
             A list of suggested strings to complete the code.
         """
         prefix = code[:cursor_pos]  # current line of code as a string?
-        words = prefix.split(" ")   # current line w/ words parsed into list
-        last_word = words[-1]
+        last_word = prefix.rpartition(" ")[2]
         last_char = prefix[-1]
         _logger.debug('code="%s" prefix="%s" last_word="%s"', code, prefix, last_word)
 
@@ -424,10 +561,32 @@ class Session(AbstractContextManager):
             _logger.debug("standard auto-complete")
             _logger.debug("6A123456")
 
+            stmts = None
+            expected = []
             try:
-                stmt = self.parse(prefix)
-                _logger.debug("first parse: %s", stmt)
-                last_stmt = stmt[-1]
+                # single pass: feed the prefix and ask the parser what's next
+                parser = parse_kestrel_interactive(
+                    prefix,
+                    self.config["language"]["default_variable"],
+                    self.config["language"]["default_sort_order"],
+                )
+                parser.exhaust_lexer()
+                expected = parser.accepts()
+                if "$END" in expected:
+                    # the prefix is a complete code block
+                    expected.discard("$END")
+                    stmts = parser.feed_eof()
+                    _logger.debug("parsed prefix: %s", stmts)
+            except lark.UnexpectedInput:
+                # fall back to a full parse to get expected tokens at the error
+                try:
+                    self.parse(prefix)
+                except KestrelSyntaxError as e:
+                    _logger.debug("exception: %s", e)
+                    expected = e.expected
+
+            if stmts:
+                last_stmt = stmts[-1]
                 if last_stmt["command"] == "assign" and last_stmt["output"] == "_":
                     # Special case for a varname alone on a line
                     allnames = [
@@ -436,88 +595,84 @@ class Session(AbstractContextManager):
                     if not allnames:
                         return ["=", "+"] if prefix.endswith(" ") else []
 
-                # If it parses successfully, add something so it will fail
-                self.parse(prefix + "@autocompletions@")
-                # self.parse(prefix + " @autocompletions@")
-            except KestrelSyntaxError as e:
-                _logger.debug("exception: %s", e)
-                varnames = self.get_variable_names()
-                keywords = set(get_keywords())
-                _logger.debug("keywords: %s", keywords)
-                tmp = []
-                for token in e.expected:
-                    _logger.debug("token: %s", token)
-                    if token == "VARIABLE":
-                        tmp.extend(varnames)
-                    elif token == "DATASRC_SIMPLE":
-                        schemes = self.data_source_manager.schemes()
-                        tmp.extend([f"{scheme}://" for scheme in schemes])
-                    elif token == "DATASRC_ESCAPED":
-                        continue
-                    elif token == "ANALYTICS_SIMPLE":
-                        schemes = self.analytics_manager.schemes()
-                        tmp.extend([f"{scheme}://" for scheme in schemes])
-                    elif token == "ENTITY_TYPE":
+            varnames = self.get_variable_names()
+            keywords = _get_keywords_lower()
+            _logger.debug("keywords: %s", keywords)
+            tmp = []
+            for token in expected:
+                _logger.debug("token: %s", token)
+                if token == "VARIABLE":
+                    tmp.extend(varnames)
+                elif token == "DATASRC_SIMPLE":
+                    schemes = self.data_source_manager.schemes()
+                    tmp.extend([f"{scheme}://" for scheme in schemes])
+                elif token == "DATASRC_ESCAPED":
+                    continue
+                elif token == "ANALYTICS_SIMPLE":
+                    schemes = self.analytics_manager.schemes()
+                    tmp.extend([f"{scheme}://" for scheme in schemes])
+                elif token == "ENTITY_TYPE":
+                    tmp.extend(get_entity_types())
+                elif token == "ATTRIBUTES":
+                    # TODO: figure out the varname and get its attrs
+                    # how to figure out what the variable name is??
+                        # Check line for most recently mentioned variable
+                        # do i need a separate function to do this?
+                        # loop through? string if needed? idk
+                    # "function" checking for the last called variable
+                    # still unsure how to limit it to just the beginning of a statement
+                    # write this loop as 1-liner somehow? or separate func w/ included functionality (above)?
+                    attr_var = ""
+                    # split the whole line only in this rare case
+                    for v in reversed(prefix.split(" ")):
+                        if v in varnames:
+                            attr_var = self.symtable[v]
+                            break
+                        # elif v in commands
+                        # also risk it takes in v from a comment line...
+                    # tentative method to address whether the variable has been initialised in current session already
+                    if attr_var:
+                        tmp.extend(self.store.columns(attr_var.entity_table))
+                        # yayyy it workssss! ('ATTR ')
+                        # the testing output is giving me "new" and "name" ('ATTR n')
+                        # for the autofill options; should only show "name"
+                        # why is "new" in this list?? maybe something remaining from prev. autocompletion?
+                            # BUG REPORT FOR THIS??? Not parsing tokens correctly
+                            # Treating 'n' as complete attribute... unintended behavior.
+                elif token.startswith("STIXPATTERNBODY"):
+                    # TODO: figure out how to complete STIX patterns
+                    continue
+                elif token == "RELATION":
+                    if last_word:
                         tmp.extend(get_entity_types())
-                    elif token == "ATTRIBUTES":
-                        # TODO: figure out the varname and get its attrs
-                        # how to figure out what the variable name is??
-                            # Check line for most recently mentioned variable
-                            # do i need a separate function to do this?
-                            # loop through? string if needed? idk
-                        # "function" checking for the last called variable
-                        # still unsure how to limit it to just the beginning of a statement
-                        # write this loop as 1-liner somehow? or separate func w/ included functionality (above)?
-                        attr_var = ""
-                        for v in reversed(words):
-                            if v in varnames:
-                                attr_var = self.symtable[v]
-                                break
-                            # elif v in commands
-                            # also risk it takes in v from a comment line...
-                        # tentative method to address whether the variable has been initialised in current session already
-                        if attr_var:
-                            tmp.extend(self.store.columns(attr_var.entity_table))
-                            # yayyy it workssss! ('ATTR ')
-                            # the testing output is giving me "new" and "name" ('ATTR n')
-                            # for the autofill options; should only show "name"
-                            # why is "new" in this list?? maybe something remaining from prev. autocompletion?
-                                # BUG REPORT FOR THIS??? Not parsing tokens correctly
-                                # Treating 'n' as complete attribute... unintended behavior.
-                    elif token.startswith("STIXPATTERNBODY"):
-                        # TODO: figure out how to complete STIX patterns
-                        continue
-                    elif token == "RELATION":
-                        if last_word:
-                            tmp.extend(get_entity_types())
-                        else:
-                            tmp.extend(all_relations)
-                    elif token == "BY":
+                    else:
+                        tmp.extend(all_relations)
+                elif token == "BY":
+                    tmp.append("BY")
+                elif token == "REVERSED":
+                    if last_char == " ":
                         tmp.append("BY")
-                    elif token == "REVERSED":
-                        if last_char == " ":
-                            tmp.append("BY")
-                        else:
-                            # "procs = FIND process l" will expect ['REVERSED', 'VARIABLE']
-                            # override results from the case of VARIABLE
-                            tmp = all_relations
-                            break
-                    elif token == "FUNCNAME":
-                        tmp.extend(AGG_FUNCS)
-                    elif token == "TRANSFORM":
-                        tmp.extend(TRANSFORMS)
-                    elif token in LITERALS:
-                        continue
-                    elif token.startswith("__ANON"):
-                        continue
-                    elif token == "EQUAL":
-                        tmp.append("=")
-                    elif token in keywords and last_word.islower():
-                        # keywords has both upper and lower case
-                        tmp.append(token.lower())
                     else:
-                        tmp.append(token)
-                allnames = sorted(tmp)
+                        # "procs = FIND process l" will expect ['REVERSED', 'VARIABLE']
+                        # override results from the case of VARIABLE
+                        tmp = all_relations
+                        break
+                elif token == "FUNCNAME":
+                    tmp.extend(AGG_FUNCS)
+                elif token == "TRANSFORM":
+                    tmp.extend(TRANSFORMS)
+                elif token in LITERALS:
+                    continue
+                elif token.startswith("__ANON"):
+                    continue
+                elif token == "EQUAL":
+                    tmp.append("=")
+                elif token in keywords and last_word.islower():
+                    # keywords has both upper and lower case
+                    tmp.append(keywords[token])
+                else:
+                    tmp.append(token)
+            allnames = sorted(tmp)
 
         suggestions = [
             name[len(last_word) :] for name in allnames if name.startswith(last_word)
@@ -531,69 +686,61 @@ class Session(AbstractContextManager):
         This may be executed by a context manager or when the program exits.
         """
         # this subroutine could be invoked twice by a context manager and program exit.
-        # only execute it once (when self.store not deleted).
-        if hasattr(self, "store"):
-
-            # release resources
-            self.store.close()
+        # the finalizer only executes once (when it is still alive).
+        if self._finalizer.alive:
+            self._finalizer()
             del self.store
 
-            # manage temp folder for debug
-            if not self.runtime_directory_is_owned_by_upper_layer:
-                if self.debug_mode:
-                    self._leave_exit_marker()
-                    self._remove_obsolete_debug_folders()
-                else:
-                    shutil.rmtree(self.runtime_directory)
-
     def __exit__(self, exception_type, exception_value, traceback):
         self.close()
 
     def _execute_ast(self, ast):
         displays = []
-        new_vars = []
+        # insertion-ordered set of new variable names
+        new_vars = {}
+        default_variable = self.config["language"]["default_variable"]
 
-        start_exec_ts = time.time()
-        for stmt in ast:
+        start_exec_ns = time.monotonic_ns()
+        # set current working directory for the execution of all commands
+        # use this to implicitly pass runtime_dir as an argument to each command
+        # the context manager switch back cwd when the code block completes
+        with set_current_working_directory(self.runtime_directory):
+            for stmt in ast:
 
-            try:
-                # semantic checking and unfolding
-                semantics_processing(
-                    stmt,
-                    self.symtable,
-                    self.store,
-                    self.data_source_manager,
-                    self.config,
-                )
-
-                # code generation and execution
-                execute_cmd = getattr(commands, stmt["command"])
+                try:
+                    # semantic checking and unfolding
+                    semantics_processing(
+                        stmt,
+                        self.symtable,
+                        self.store,
+                        self.data_source_manager,
+                        self.config,
+                    )
 
-                # set current working directory for each command execution
-                # use this to implicitly pass runtime_dir as an argument to each command
-                # the context manager switch back cwd when the command execution completes
-                with set_current_working_directory(self.runtime_directory):
+                    # code generation and execution
+                    execute_cmd = _CMD_TABLE[stmt["command"]]
                     output_var_struct, display = execute_cmd(stmt, self)
 
-            # exception completion
-            except StixPatternError as e:
-                raise InvalidStixPattern(e.stix) from e
+                # exception completion
+                except StixPatternError as e:
+                    raise InvalidStixPattern(e.stix) from e
 
-            # post-processing: symbol table update
-            if output_var_struct is not None:
-                output_var_name = stmt["output"]
-                self._update_symbol_table(output_var_name, output_var_struct)
+                # post-processing: symbol table update
+                if output_var_struct is not None:
+                    output_var_name = stmt["output"]
+                    self._update_symbol_table(output_var_name, output_var_struct)
 
-                if output_var_name != self.config["language"]["default_variable"]:
-                    if output_var_name in new_vars:
-                        new_vars.remove(output_var_name)
-                    new_vars.append(output_var_name)
+                    if output_var_name != default_variable:
+                        # move a reassigned variable to the end
+                        new_vars.pop(output_var_name, None)
+                        new_vars[output_var_name] = None
 
-            if display is not None:
-                displays.append(display)
+                if display is not None:
+                    displays.append(display)
 
-        end_exec_ts = time.time()
-        execution_time_sec = math.ceil(end_exec_ts - start_exec_ts)
+        end_exec_ns = time.monotonic_ns()
+        # round up to whole seconds
+        execution_time_sec = -(-(end_exec_ns - start_exec_ns) // 1_000_000_000)
 
         if self.config["session"]["show_execution_summary"] and new_vars:
             vars_summary = [
@@ -604,75 +751,41 @@ class Session(AbstractContextManager):
         return displays
 
     def _update_symbol_table(self, output_var_name, output_var_struct):
+        output_var_name = sys.intern(output_var_name)
         self.symtable[output_var_name] = output_var_struct
-        self.symtable[self.config["language"]["default_variable"]] = output_var_struct
-
-    def _leave_exit_marker(self):
-        exit_marker = os.path.join(
-            self.runtime_directory, self.config["debug"]["session_exit_marker"]
-        )
-        with open(exit_marker, "w"):
-            pass
-
-    def _remove_obsolete_debug_folders(self):
-        # will only clean debug cache directories under system temp directory
-
-        # [(cache_dir, timestamp)]
-        exited_sessions = []
-
-        for x in pathlib.Path(tempfile.gettempdir()).iterdir():
-            if x.is_dir() and x.parts[-1].startswith(
-                self.config["session"]["cache_directory_prefix"]
-                + str(os.getuid())
-                + "-"
-            ):
-                marker = x / self.config["debug"]["session_exit_marker"]
-                if marker.exists():
-                    exited_sessions.append((x, marker.stat().st_mtime))
-
-        # preserve the newest self.config["debug"]["maximum_exited_session"] debug sessions
-        exited_sessions.sort(key=lambda x: x[1])
-        for x, _ in exited_sessions[: -self.config["debug"]["maximum_exited_session"]]:
-            shutil.rmtree(x)
+        default_variable = self.config["language"]["default_variable"]
+        if output_var_name != default_variable:
+            self.symtable[default_variable] = output_var_struct
+
+    def _tune_sqlite_store(self):
+        pragmas = self.config["session"]["sqlite_pragmas"]
+        if pragmas:
+            _logger.debug(f"apply SQLite PRAGMAs: {pragmas}")
+            self.store.connection.executescript(
+                "".join(f"PRAGMA {k}={v};" for k, v in pragmas.items())
+            )
 
     def _get_complete_timestamp(self, ts_str):
-        valid_ts_formats = [
-            "%Y",
-            "%Y-%m",
-            "%Y-%m-%d",
-            "%Y-%m-%dT%H",
-            "%Y-%m-%dT%H:%M",
-            "%Y-%m-%dT%H:%M:%S",
-        ]
-        complete_ts = []
-        for vts in valid_ts_formats:
-            ts = ts_str.split("'")[-1]
-            matched = self._iso_ts.match(ts)
-            if matched:
-                try:
-                    ts_iso = datetime.strptime(matched.group(), vts).isoformat()
-                    complete_ts.append(ts_iso[len(ts) :] + "Z'")
-                    if complete_ts:
-                        return complete_ts
-                except:
-                    _logger.debug(f"Try to match timestamp {ts} by format {vts}")
-                    pass
+        ts = ts_str.split("'")[-1]
+        matched = _ISO_TS_RE.match(ts)
+        # a timestamp ending with Z is complete
+        if matched and not matched.group().endswith("Z"):
+            # build datetime from the matched components, no strptime() needed
+            components = (
+                int(g) if g is not None else d
+                for g, d in zip(matched.groups(), _TS_DEFAULTS)
+            )
+            try:
+                ts_iso = datetime(*components).isoformat()
+            except ValueError:
+                _logger.debug(f"Try to match timestamp {ts}")
+            else:
+                return [ts_iso[len(ts) :] + "Z'"]
 
     def _get_runtime_directory_master(self):
         sys_tmp_dir = pathlib.Path(tempfile.gettempdir())
-
-        user_suffix = None
-        for f in [getpass.getuser, os.getuid]:
-            if not user_suffix:
-                try:
-                    user_suffix = f()
-                except:
-                    pass
-        if not user_suffix:
-            user_suffix = "noUID"
-
         return sys_tmp_dir / (
-            self.config["debug"]["cache_directory_prefix"] + user_suffix
+            self.config["debug"]["cache_directory_prefix"] + _get_user_suffix()
         )
 
     def _setup_runtime_directory_master(self):
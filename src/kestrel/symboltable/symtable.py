@@ -2,8 +2,20 @@ from kestrel.exceptions import VariableNotExist
 
 
 class SymbolTable(dict):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # deref closures over (store, self): (store, funcs)
+        # kept here so they are released together with the session
+        self._deref_funcs = None
+
     def __getitem__(self, var_name):
         try:
             return super().__getitem__(var_name)
         except KeyError as e:
             raise VariableNotExist(var_name)
+
+    def get_deref_funcs(self, store, make_funcs):
+        # make_funcs() is only called when there is no cache for this store
+        if self._deref_funcs is None or self._deref_funcs[0] is not store:
+            self._deref_funcs = (store, make_funcs())
+        return self._deref_funcs[1]
@@ -1,10 +1,16 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from pkgutil import get_data
+import functools
+import hashlib
 import importlib
-from lark import Lark, Token, Transformer
+import os
+import pathlib
+import stat
+import sys
+import lark
+from lark import Lark, Token, Transformer, v_args
 from lark.visitors import merge_transformers
 
-from firepit.timestamp import to_datetime
 from firepit.query import BinnedColumn
 from kestrel.utils import unescape_quoted_string, resolve_path
 from kestrel.syntax.utils import resolve_uri
@@ -18,6 +24,36 @@ from kestrel.syntax.ecgpattern import (
 DEFAULT_VARIABLE = "_"
 DEFAULT_SORT_ORDER = "DESC"
 
+# timedelta() keyword for each time unit token in timespan_relative
+_TIMEDELTA_KW_OF_UNIT = {
+    "DAY": "days",
+    "HOUR": "hours",
+    "MINUTE": "minutes",
+    "SECOND": "seconds",
+}
+
+# statements with default values, copied and then filled by the transformer
+# values are immutable so the shallow dict.copy() is safe
+_DISP_TEMPLATE = {"command": "disp", "attrs": "*"}
+_GET_TEMPLATE = {"command": "get", "type": None, "timerange": None}
+_FIND_TEMPLATE = {
+    "command": "find",
+    "type": None,
+    "relation": None,
+    "reversed": False,
+    "input": None,
+    "timerange": None,
+}
+
+# where Lark resolves %import in ecgpattern.lark and reference.lark
+_IMPORT_PATHS = importlib.util.find_spec("kestrel.syntax").submodule_search_locations
+
+# private per-user directory for the pickled LALR tables of the grammars
+_LARK_CACHE_DIR = (
+    pathlib.Path(os.getenv("XDG_CACHE_HOME") or pathlib.Path.home() / ".cache")
+    / "kestrel"
+)
+
 
 def parse_kestrel(
     stmts, default_variable=DEFAULT_VARIABLE, default_sort_order=DEFAULT_SORT_ORDER
@@ -25,32 +61,39 @@ def parse_kestrel(
     # the public parsing interface for Kestrel
     # return abstract syntax tree
     # check kestrel.lark for details
+    return _build_kestrel_parser(default_variable, default_sort_order).parse(stmts)
+
+
+def parse_kestrel_interactive(
+    stmts, default_variable=DEFAULT_VARIABLE, default_sort_order=DEFAULT_SORT_ORDER
+):
+    # return a lark interactive parser on the code, which is not fed yet
+    # use it to get the acceptable next tokens, e.g., for code completion
+    parser = _build_kestrel_parser(default_variable, default_sort_order)
+    return parser.parse_interactive(stmts)
+
+
+# building the LALR tables dominates the parsing time of short statements
+# the transformers hold no state other than the defaults, so cache the parsers
+# Lark also persists the tables on disk for cold starts, see _get_lark_cache()
+@functools.lru_cache(maxsize=16)
+def _build_kestrel_parser(default_variable, default_sort_order):
     grammar = get_data(__name__, "kestrel.lark").decode("utf-8")
     return Lark(
         grammar,
         parser="lalr",
+        cache=_get_lark_cache("kestrel", grammar),
         transformer=_KestrelT(default_variable, default_sort_order),
-    ).parse(stmts)
+    )
 
 
 def parse_ecgpattern(pattern_str) -> ExtCenteredGraphPattern:
-    grammar = get_data(__name__, "ecgpattern.lark").decode("utf-8")
-    paths = importlib.util.find_spec("kestrel.syntax").submodule_search_locations
-    return Lark(
-        grammar,
-        parser="lalr",
-        import_paths=paths,
-        transformer=merge_transformers(_ECGPatternT(), kestrel=_KestrelT()),
-    ).parse(pattern_str)
+    return _build_ecgpattern_parser().parse(pattern_str)
 
 
 def parse_reference(value_str) -> Reference:
-    grammar = get_data(__name__, "reference.lark").decode("utf-8")
-    paths = importlib.util.find_spec("kestrel.syntax").submodule_search_locations
-    parser = Lark(grammar, parser="lalr", import_paths=paths)
-
     try:
-        ast = parser.parse(value_str)
+        ast = _build_reference_parser().parse(value_str)
     except:
         return None
 
@@ -60,6 +103,51 @@ def parse_reference(value_str) -> Reference:
     return Reference(variable, attribute)
 
 
+@functools.lru_cache(maxsize=1)
+def _build_ecgpattern_parser():
+    grammar = get_data(__name__, "ecgpattern.lark").decode("utf-8")
+    return Lark(
+        grammar,
+        parser="lalr",
+        cache=_get_lark_cache("ecgpattern", grammar),
+        import_paths=_IMPORT_PATHS,
+        transformer=merge_transformers(_ECGPatternT(), kestrel=_KestrelT()),
+    )
+
+
+@functools.lru_cache(maxsize=1)
+def _build_reference_parser():
+    grammar = get_data(__name__, "reference.lark").decode("utf-8")
+    return Lark(
+        grammar,
+        parser="lalr",
+        cache=_get_lark_cache("reference", grammar),
+        import_paths=_IMPORT_PATHS,
+    )
+
+
+def _get_lark_cache(grammar_name, grammar):
+    # Lark pickle.load() the cache file, so it must not be writable by others
+    # cache=True would use a predictable file in the shared temp directory
+    # return: the cache file in a private directory; False to disable the cache
+    try:
+        _LARK_CACHE_DIR.mkdir(mode=0o700, parents=True, exist_ok=True)
+        dir_stat = os.lstat(_LARK_CACHE_DIR)
+    except OSError:
+        return False
+    if not stat.S_ISDIR(dir_stat.st_mode) or dir_stat.st_mode & 0o077:
+        return False
+    if hasattr(os, "getuid") and dir_stat.st_uid != os.getuid():
+        return False
+    # Lark checks the grammar/options hash stored in the file before using it
+    # name the file by grammar and versions like Lark does, so environments
+    # sharing the directory (e.g., venvs of other Pythons) do not overwrite it
+    grammar_hash = hashlib.sha256(grammar.encode("utf-8")).hexdigest()[:16]
+    py_version = "%d.%d" % sys.version_info[:2]
+    cache_name = f"{grammar_name}_{grammar_hash}_{lark.__version__}_{py_version}"
+    return str(_LARK_CACHE_DIR / f"{cache_name}.lark.cache")
+
+
 class _ECGPatternT(Transformer):
     def start(self, args):
         return ExtCenteredGraphPattern(args[0])
@@ -101,56 +189,45 @@ class _KestrelT(Transformer):
         return {"command": "info", "input": _extract_var(args, self.default_variable)}
 
     def disp(self, args):
-        packet = {"command": "disp"}
+        packet = _DISP_TEMPLATE.copy()
         for arg in args:
             if isinstance(arg, dict):
                 packet.update(arg)
-        if "attrs" not in packet:
-            packet["attrs"] = "*"
         return packet
 
     def get(self, args):
-        packet = {
-            "command": "get",
-            "type": _extract_entity_type(args),
-        }
-
-        for item in args:
-            if isinstance(item, dict):
-                packet.update(item)
+        tokens, dicts = _split_args(args)
+        packet = _GET_TEMPLATE.copy()
+        packet["type"] = tokens.get("ENTITY_TYPE")
 
-        if "timerange" not in packet:
-            packet["timerange"] = None
+        for item in dicts:
+            packet.update(item)
 
         return packet
 
     def find(self, args):
-        packet = {
-            "command": "find",
-            "type": _extract_entity_type(args),
-            "relation": _assert_and_extract_single("RELATION", args).lower(),
-            "reversed": _extract_if_reversed(args),
-            "input": _extract_var(args, self.default_variable),
-        }
-
-        for item in args:
-            if isinstance(item, dict):
-                packet.update(item)
+        tokens, dicts = _split_args(args)
+        packet = _FIND_TEMPLATE.copy()
+        packet["type"] = tokens.get("ENTITY_TYPE")
+        packet["relation"] = tokens["RELATION"].lower()
+        packet["reversed"] = "REVERSED" in tokens
+        packet["input"] = _get_var(tokens, self.default_variable)
 
-        if "timerange" not in packet:
-            packet["timerange"] = None
+        for item in dicts:
+            packet.update(item)
 
         return packet
 
-    def join(self, args):
+    @v_args(inline=True)
+    def join(self, var_1, var_2, by=None, attr_1=None, attr_2=None):
         packet = {
             "command": "join",
-            "input": _first(args),
-            "input_2": _second(args),
+            "input": sys.intern(var_1.value),
+            "input_2": sys.intern(var_2.value),
         }
-        if len(args) == 5:
-            packet["attribute_1"] = _fourth(args)
-            packet["attribute_2"] = _fifth(args)
+        if by:
+            packet["attribute_1"] = attr_1.value
+            packet["attribute_2"] = attr_2.value
 
         return packet
 
@@ -166,11 +243,12 @@ class _KestrelT(Transformer):
         return packet
 
     def sort(self, args):
+        tokens, _ = _split_args(args)
         return {
             "command": "sort",
-            "attribute": _extract_attribute(args),
-            "input": _extract_var(args, self.default_variable),
-            "ascending": _extract_direction(args, self.default_sort_order),
+            "attribute": tokens.get("ATTRIBUTE"),
+            "input": _get_var(tokens, self.default_variable),
+            "ascending": _is_ascending(tokens, self.default_sort_order),
         }
 
     def apply(self, args):
@@ -184,75 +262,81 @@ class _KestrelT(Transformer):
         return packet
 
     def load(self, args):
+        tokens, dicts = _split_args(args)
         packet = {
             "command": "load",
-            "type": _extract_entity_type(args),
+            "type": tokens.get("ENTITY_TYPE"),
         }
-        for arg in args:
-            if isinstance(arg, dict):
-                packet.update(arg)
+        for arg in dicts:
+            packet.update(arg)
         return packet
 
     def save(self, args):
+        tokens, dicts = _split_args(args)
         packet = {
             "command": "save",
-            "input": _extract_var(args, self.default_variable),
+            "input": _get_var(tokens, self.default_variable),
         }
-        for arg in args:
-            if isinstance(arg, dict):
-                packet.update(arg)
+        for arg in dicts:
+            packet.update(arg)
         return packet
 
     def new(self, args):
+        tokens, _ = _split_args(args)
         return {
             "command": "new",
-            "type": _extract_entity_type(args),
-            "data": _assert_and_extract_single("VAR_DATA", args),
+            "type": tokens.get("ENTITY_TYPE"),
+            "data": tokens.get("VAR_DATA"),
         }
 
     def expression(self, args):
+        # the transform dict is the packet: merge the clauses into it
         packet = args[0]
-        for arg in args:
+        for arg in args[1:]:
             packet.update(arg)
         return packet
 
     def transform(self, args):
+        tokens, _ = _split_args(args)
         return {
-            "input": _extract_var(args, self.default_variable),
-            "transform": _assert_and_extract_single("TRANSFORM", args),
+            "input": _get_var(tokens, self.default_variable),
+            "transform": tokens.get("TRANSFORM"),
         }
 
-    def where_clause(self, args):
-        pattern = ExtCenteredGraphPattern(args[0])
+    @v_args(inline=True)
+    def where_clause(self, ecg_pattern):
+        pattern = ExtCenteredGraphPattern(ecg_pattern)
         return {
             "where": pattern,
         }
 
-    def expression_or(self, args):
-        return ECGPJunction("OR", args[0], args[1])
+    @v_args(inline=True)
+    def expression_or(self, lhs, rhs):
+        return ECGPJunction("OR", lhs, rhs)
 
-    def expression_and(self, args):
-        return ECGPJunction("AND", args[0], args[1])
+    @v_args(inline=True)
+    def expression_and(self, lhs, rhs):
+        return ECGPJunction("AND", lhs, rhs)
 
-    def comparison_std(self, args):
-        etype, attr = _extract_entity_and_attribute(args[0].value)
-        # remove more than one spaces; capitalize op
-        op = " ".join(_second(args).split()).upper()
-        value = args[2]
+    @v_args(inline=True)
+    def comparison_std(self, path, op, value):
+        etype, attr = _extract_entity_and_attribute(path.value)
+        op = _canonicalize_op(op.value)
         return ECGPComparison(attr, op, value, etype)
 
-    def comparison_null(self, args):
-        etype, attr = _extract_entity_and_attribute(args[0].value)
-        op = _second(args)
-        if "NOT" in op:
+    @v_args(inline=True)
+    def comparison_null(self, path, null_op, null):
+        etype, attr = _extract_entity_and_attribute(path.value)
+        if "NOT" in null_op.value:
             op = "!="
         else:
             op = "="
         value = "NULL"
         return ECGPComparison(attr, op, value, etype)
 
-    def value(self, args):
-        return args[0]
+    @v_args(inline=True)
+    def value(self, v):
+        return v
 
     def literal_list(self, args):
         if len(args) == 1:
@@ -260,19 +344,22 @@ class _KestrelT(Transformer):
         else:
             return args
 
-    def literal(self, args):
-        if args[0].type == "NUMBER":
+    @v_args(inline=True)
+    def literal(self, token):
+        if token.type == "NUMBER":
             try:
-                v = int(args[0].value)
+                v = int(token.value)
             except:
-                v = float(args[0].value)
-        elif args[0].type == "ESCAPED_STRING":
-            v = unescape_quoted_string(args[0].value)
+                v = float(token.value)
+        elif token.type == "ESCAPED_STRING":
+            v = unescape_quoted_string(token.value)
         else:
-            v = args[0].value
-            ref = parse_reference(v)
-            if ref:
-                v = ref
+            v = token.value
+            # a reference is always VARIABLE.ATTRIBUTE (reference.lark)
+            if "." in v:
+                ref = parse_reference(v)
+                if ref:
+                    v = ref
         return v
 
     def attr_clause(self, args):
@@ -282,67 +369,69 @@ class _KestrelT(Transformer):
         }
 
     def sort_clause(self, args):
+        tokens, _ = _split_args(args)
         return {
-            "attribute": _extract_attribute(args),
-            "ascending": _extract_direction(args, self.default_sort_order),
+            "attribute": tokens.get("ATTRIBUTE"),
+            "ascending": _is_ascending(tokens, self.default_sort_order),
         }
 
-    def limit_clause(self, args):
+    @v_args(inline=True)
+    def limit_clause(self, num):
         return {
-            "limit": int(_first(args)),
+            "limit": int(num.value),
         }
 
-    def offset_clause(self, args):
+    @v_args(inline=True)
+    def offset_clause(self, num):
         return {
-            "offset": int(_first(args)),
+            "offset": int(num.value),
         }
 
-    def timespan_relative(self, args):
-        num = int(args[0])
-        unit = args[1]
-        if unit.type == "DAY":
-            delta = timedelta(days=num)
-        elif unit.type == "HOUR":
-            delta = timedelta(hours=num)
-        elif unit.type == "MINUTE":
-            delta = timedelta(minutes=num)
-        elif unit.type == "SECOND":
-            delta = timedelta(seconds=num)
+    @v_args(inline=True)
+    def timespan_relative(self, num, unit):
+        num = int(num.value)
+        delta = timedelta(**{_TIMEDELTA_KW_OF_UNIT[unit.type]: num})
         stop = datetime.utcnow()
         start = stop - delta
         return {"timerange": (start, stop)}
 
-    def timespan_absolute(self, args):
-        start = to_datetime(args[0])
-        stop = to_datetime(args[1])
+    @v_args(inline=True)
+    def timespan_absolute(self, start, stop):
+        start = _isotimestamp_to_datetime(start)
+        stop = _isotimestamp_to_datetime(stop)
         return {"timerange": (start, stop)}
 
-    def timestamp(self, args):
-        return _assert_and_extract_single("ISOTIMESTAMP", args)
+    @v_args(inline=True)
+    def timestamp(self, ts):
+        return ts.value
 
-    def entity_type(self, args):
-        return _first(args)
+    @v_args(inline=True)
+    def entity_type(self, etype):
+        return etype.value
 
     def variables(self, args):
         return {"variables": _extract_vars(args, self.default_variable)}
 
-    def stdpath(self, args):
-        v = _first(args)
-        if args[0].type == "PATH_ESCAPED":
+    @v_args(inline=True)
+    def stdpath(self, path):
+        v = path.value
+        if path.type == "PATH_ESCAPED":
             v = unescape_quoted_string(v)
         v = resolve_path(v)
         return {"path": v}
 
-    def datasource(self, args):
-        v = _first(args)
-        if args[0].type == "DATASRC_ESCAPED":
+    @v_args(inline=True)
+    def datasource(self, ds):
+        v = ds.value
+        if ds.type == "DATASRC_ESCAPED":
             v = unescape_quoted_string(v)
         v = ",".join(map(resolve_uri, v.split(",")))
         return {"datasource": v}
 
-    def analytics_uri(self, args):
-        v = _first(args)
-        if args[0].type == "ANALYTICS_ESCAPED":
+    @v_args(inline=True)
+    def analytics_uri(self, uri):
+        v = uri.value
+        if uri.type == "ANALYTICS_ESCAPED":
             v = unescape_quoted_string(v)
         return {"analytics_uri": v}
 
@@ -350,8 +439,8 @@ class _KestrelT(Transformer):
     def grp_spec(self, args):
         return args
 
-    def grp_expr(self, args):
-        item = args[0]
+    @v_args(inline=True)
+    def grp_expr(self, item):
         if isinstance(item, Token):
             # an ATTRIBUTE
             return str(item)
@@ -359,23 +448,24 @@ class _KestrelT(Transformer):
             # bin_func
             return item
 
-    def bin_func(self, args):
-        attr = _first(args)
-        num = int(_second(args))
-        if len(args) >= 3:
-            unit = _third(args)
-        else:
-            unit = None
+    @v_args(inline=True)
+    def bin_func(self, attr, num, unit=None):
+        attr = attr.value
+        num = int(num.value)
+        if unit is not None:
+            unit = unit.value
         alias = f"{attr}_bin"
         return BinnedColumn(attr, num, unit, alias=alias)
 
+    # Lark hands each reduction a new list: return it as is
     def agg_list(self, args):
-        return [arg for arg in args]
+        return args
 
-    def agg(self, args):
-        func = _first(args).lower()
-        attr = _second(args)
-        alias = _third(args) if len(args) > 2 else f"{func}_{attr}"
+    @v_args(inline=True)
+    def agg(self, func, attr, alias=None):
+        func = func.value.lower()
+        attr = attr.value
+        alias = alias.value if alias is not None else f"{func}_{attr}"
         return {"func": func, "attr": attr, "alias": alias}
 
     def args(self, args):
@@ -384,82 +474,84 @@ class _KestrelT(Transformer):
             d.update(di)
         return {"arguments": d}
 
-    def arg_kv_pair(self, args):
-        return {_first(args): args[1]}
-
-
-def _first(args):
-    return args[0].value
-
-
-def _second(args):
-    return args[1].value
+    @v_args(inline=True)
+    def arg_kv_pair(self, key, value):
+        return {key.value: value}
 
 
-def _third(args):
-    return args[2].value
-
-
-def _fourth(args):
-    return args[3].value
-
-
-def _fifth(args):
-    return args[4].value
+def _assert_and_extract_single(arg_type, args):
+    # scan without building a list of matches
+    value = None
+    for arg in args:
+        if getattr(arg, "type", None) == arg_type:
+            assert value is None
+            value = arg.value
+    return value
 
 
-def _last(args):
-    return args[-1].value
+def _split_args(args):
+    # a single pass over args of a rule
+    # return: ({token type: value}, [dicts from transformed subrules])
+    tokens = {}
+    dicts = []
+    for arg in args:
+        if isinstance(arg, dict):
+            dicts.append(arg)
+        elif isinstance(arg, Token):
+            assert arg.type not in tokens
+            tokens[arg.type] = arg.value
+    return tokens, dicts
 
 
-def _assert_and_extract_single(arg_type, args):
-    items = [arg.value for arg in args if hasattr(arg, "type") and arg.type == arg_type]
-    assert len(items) <= 1
-    return items.pop() if items else None
+def _get_var(tokens, default_variable):
+    # the variable from _split_args() tokens
+    # default variable if no variable is found
+    v = tokens.get("VARIABLE")
+    return sys.intern(v) if v else default_variable
 
 
 def _extract_var(args, default_variable):
     # extract a single variable from the args
     # default variable if no variable is found
+    # variable names repeat across statements: intern them for symtable lookups
     v = _assert_and_extract_single("VARIABLE", args)
-    return v if v else default_variable
+    return sys.intern(v) if v else default_variable
 
 
 def _extract_vars(args, default_variable):
-    var_names = []
-    for arg in args:
-        if hasattr(arg, "type") and arg.type == "VARIABLE":
-            var_names.append(arg.value)
-    if not var_names:
-        var_names = [default_variable]
-    return var_names
-
-
-def _extract_attribute(args):
-    # extract a single attribute from the args
-    return _assert_and_extract_single("ATTRIBUTE", args)
-
-
-def _extract_entity_type(args):
-    # extract a single entity type from the args
-    return _assert_and_extract_single("ENTITY_TYPE", args)
-
-
-def _extract_direction(args, default_sort_order):
-    # extract sort direction from args
-    # default direction if no variable is found
-    # return: if descending
-    ds = [
-        x for x in args if hasattr(x, "type") and (x.type == "ASC" or x.type == "DESC")
+    var_names = [
+        sys.intern(arg.value)
+        for arg in args
+        if getattr(arg, "type", None) == "VARIABLE"
     ]
-    assert len(ds) <= 1
-    d = ds.pop().type if ds else default_sort_order
-    return True if d == "ASC" else False
-
-
-def _extract_if_reversed(args):
-    rs = [x for x in args if hasattr(x, "type") and x.type == "REVERSED"]
-    return True if rs else False
+    return var_names if var_names else [default_variable]
+
+
+def _is_ascending(tokens, default_sort_order):
+    # sort direction from _split_args() tokens
+    # default direction if no direction is found
+    if "ASC" in tokens:
+        return True
+    if "DESC" in tokens:
+        return False
+    return default_sort_order == "ASC"
+
+
+def _isotimestamp_to_datetime(ts):
+    # ISOTIMESTAMP in kestrel.lark: YYYY-MM-DDTHH:MM:SS[.fraction]Z
+    # its fixed layout does not need a general parser like dateutil
+    dt = datetime.fromisoformat(ts[:19])
+    # fraction truncated to microseconds
+    fraction = ts[20:-1]
+    microsecond = int(fraction[:6].ljust(6, "0")) if fraction else 0
+    return dt.replace(microsecond=microsecond, tzinfo=timezone.utc)
+
+
+# few distinct operator spellings: cache them
+@functools.lru_cache(maxsize=64)
+def _canonicalize_op(op):
+    # remove more than one spaces; capitalize op
+    return " ".join(op.split()).upper()
 
 
 def _extract_entity_and_attribute(s):
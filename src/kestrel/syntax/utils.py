@@ -2,6 +2,7 @@ from typeguard import typechecked
 from lark import Lark
 from pkgutil import get_data
 from itertools import chain
+import functools
 from typing import Tuple, Iterable
 import datetime
 import os
@@ -16,19 +17,26 @@ from kestrel.codegen.relations import (
 LITERALS = {"CNAME", "LETTER", "DIGIT", "WS", "INT", "WORD", "ESCAPED_STRING", "NUMBER"}
 AGG_FUNCS = {"MIN", "MAX", "AVG", "SUM", "COUNT", "NUNIQUE"}
 TRANSFORMS = {"TIMESTAMPED"}
+INPUT_REFS = ("input", "input_2", "variablesource")
 
 
 def get_keywords():
+    return list(_get_keywords())
+
+
+@functools.lru_cache(maxsize=1)
+def _get_keywords():
+    # keywords are static: compile the grammar only once
     grammar = get_data(__name__, "kestrel.lark").decode("utf-8")
     parser = Lark(grammar, parser="lalr")
     alphabet_patterns = filter(lambda x: x.pattern.value.isalnum(), parser.terminals)
     keywords = [x.pattern.value for x in alphabet_patterns] + all_relations
     keywords_lower = map(lambda x: x.lower(), keywords)
     keywords_upper = map(lambda x: x.upper(), keywords)
-    keywords_comprehensive = list(chain(keywords_lower, keywords_upper))
-    return keywords_comprehensive
+    return tuple(chain(keywords_lower, keywords_upper))
 
 
+@functools.lru_cache(maxsize=1)
 def get_entity_types():
     all_types = {"x-ibm-finding", "x-oca-asset", "x-oca-event"}
     for mapping in stix_2_0_ref_mapping:
@@ -40,9 +48,16 @@ def get_entity_types():
 
 
 def get_all_input_var_names(stmt):
-    input_refs = ["input", "input_2", "variablesource"]
-    inputs_refs = stmt["inputs"] if "inputs" in stmt else []
-    return [stmt.get(k) for k in input_refs if k in stmt] + inputs_refs
+    var_names = []
+    for k in INPUT_REFS:
+        # one dict probe per key; unset keys are absent or None
+        v = stmt.get(k)
+        if v is not None:
+            var_names.append(v)
+    inputs = stmt.get("inputs")
+    if inputs:
+        var_names.extend(inputs)
+    return var_names
 
 
 @typechecked
@@ -4,7 +4,6 @@ import importlib
 import subprocess
 import requests
 import pkg_resources
-from lxml import html
 
 from kestrel.exceptions import DataSourceError
 
@@ -12,8 +11,6 @@ from kestrel.exceptions import DataSourceError
 _logger = logging.getLogger(__name__)
 
 
-XPATH_PYPI_PKG_HOME = "/html/body/main/div[4]/div/div/div[1]/div[2]/ul/li[1]/a/@href"
-XPATH_PYPI_PKG_SOURCE = "/html/body/main/div[4]/div/div/div[1]/div[2]/ul/li[2]/a/@href"
 STIX_SHIFTER_HOMEPAGE = "https://github.com/opencybersecurityalliance/stix-shifter"
 
 
@@ -26,8 +23,12 @@ def verify_package_origin(connector_name):
     package_name = get_package_name(connector_name)
 
     try:
-        pypi_response = requests.get(f"https://pypi.org/project/{package_name}")
-        pypi_etree = html.fromstring(pypi_response.content)
+        # project metadata from the PyPI JSON API
+        pypi_response = requests.get(
+            f"https://pypi.org/pypi/{package_name}/json", timeout=10
+        )
+        pypi_response.raise_for_status()
+        pypi_info = pypi_response.json()["info"]
     except:
         raise DataSourceError(
             f'STIX-shifter connector for "{connector_name}" is not installed '
@@ -36,8 +37,10 @@ def verify_package_origin(connector_name):
         )
 
     try:
-        p_homepage = pypi_etree.xpath(XPATH_PYPI_PKG_HOME)[0]
-        p_source = pypi_etree.xpath(XPATH_PYPI_PKG_SOURCE)[0]
+        project_urls = pypi_info.get("project_urls") or {}
+        # newer metadata may only list the homepage in project_urls
+        p_homepage = pypi_info.get("home_page") or project_urls["Homepage"]
+        p_source = project_urls["Source"]
     except:
         raise DataSourceError(
             f'STIX-shifter connector for "{connector_name}" is not installed '
@@ -68,19 +71,34 @@ def check_module_availability(connector_name):
         package_name = get_package_name(connector_name)
         _logger.debug(f"guess the connector package name: {package_name}")
 
-        verify_package_origin(connector_name)
-
         stixshifter_version = pkg_resources.get_distribution("stix_shifter").version
 
-        package_w_ver = package_name + "==" + stixshifter_version
-
-        _logger.info(f'install Python package "{package_w_ver}".')
         try:
-            subprocess.check_call(
-                [sys.executable, "-m", "pip", "install", package_w_ver]
+            installed_version = pkg_resources.get_distribution(package_name).version
+        except pkg_resources.DistributionNotFound:
+            installed_version = None
+
+        if installed_version == stixshifter_version:
+            # pip would not change anything: no download, no PyPI verification
+            _logger.debug(
+                f'"{package_name}=={installed_version}" installed, skip installation.'
             )
-        except:
-            _logger.info("package installation with 'pip' failed.")
+        else:
+            # PyPI verification guards the guessed name before any download
+            verify_package_origin(connector_name)
+
+            package_w_ver = package_name + "==" + stixshifter_version
+
+            _logger.info(f'install Python package "{package_w_ver}".')
+            try:
+                subprocess.check_call(
+                    [sys.executable, "-m", "pip", "install", package_w_ver]
+                )
+            except:
+                _logger.info("package installation with 'pip' failed.")
+
+            # the import system may have cached directory listings before the install
+            importlib.invalidate_caches()
 
         try:
             importlib.import_module(
@@ -24,6 +24,19 @@ newvar = NEW [ {"type": "process", "name": "cmd.exe", "pid": "123"}
         data = out[0].to_dict()
 
 
+@pytest.mark.parametrize("attrs", ["name,pid", "name, pid", "name,\fpid"])
+def test_disp_attrs_whitespace(attrs):
+    with Session() as s:
+        stmt = """
+newvar = NEW [ {"type": "process", "name": "cmd.exe", "pid": "123"}
+             , {"type": "process", "name": "explorer.exe", "pid": "99"}
+             ]
+"""
+        s.execute(stmt)
+        out = s.execute(f"DISP newvar ATTR {attrs}")
+        assert list(out[0].dataframe.columns) == ["name", "pid"]
+
+
 def test_disp_no_vars():
     with Session() as s:
         with pytest.raises(VariableNotExist):
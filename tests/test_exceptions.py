@@ -4,6 +4,7 @@ import pytest
 
 from kestrel.exceptions import KestrelSyntaxError
 from kestrel.exceptions import VariableNotExist
+from kestrel.exceptions import MissingDataSource
 from kestrel.session import Session
 
 
@@ -53,6 +54,12 @@ def test_undefined_variable(fake_bundle_file):
         assert err.var_name == 'abc'
 
 
+def test_missing_datasource():
+    with Session(debug_mode=True) as session:
+        with pytest.raises(MissingDataSource):
+            session.execute("get process where name = 'cmd.exe'")
+
+
 def test_garbage():
     with Session(debug_mode=True) as session:
         with pytest.raises(VariableNotExist) as e:
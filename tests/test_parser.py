@@ -1,8 +1,11 @@
+import os
 import re
+import stat
 
 from lark import UnexpectedToken
 import pytest
 
+import kestrel.syntax.parser
 from kestrel.syntax.parser import parse_kestrel
 from kestrel.syntax.ecgpattern import Reference
 from kestrel.exceptions import InvalidECGPattern
@@ -209,3 +212,22 @@ def test_grouping_3():
         {"attr": "baz", "func": "count", "alias": "count_baz"},
         {"attr": "blah", "func": "max", "alias": "whatever"},
     ]
+
+
+def test_lark_cache_private_dir(tmp_path, monkeypatch):
+    cache_dir = tmp_path / "kestrel"
+    monkeypatch.setattr(kestrel.syntax.parser, "_LARK_CACHE_DIR", cache_dir)
+    cache_file = kestrel.syntax.parser._get_lark_cache("kestrel", "start: x")
+    assert os.path.dirname(cache_file) == str(cache_dir)
+    assert os.path.basename(cache_file).startswith("kestrel_")
+    # another grammar (e.g., another kestrel version) gets another file
+    assert cache_file != kestrel.syntax.parser._get_lark_cache("kestrel", "start: y")
+    assert stat.S_IMODE(os.stat(cache_dir).st_mode) == 0o700
+
+
+def test_lark_cache_disabled_for_shared_dir(tmp_path, monkeypatch):
+    cache_dir = tmp_path / "kestrel"
+    cache_dir.mkdir()
+    os.chmod(cache_dir, 0o777)
+    monkeypatch.setattr(kestrel.syntax.parser, "_LARK_CACHE_DIR", cache_dir)
+    assert kestrel.syntax.parser._get_lark_cache("kestrel", "start: x") is False
@@ -1,3 +1,4 @@
+import gc
 import json
 import logging
 import os
@@ -5,6 +6,7 @@ import pytest
 import pathlib
 import shutil
 import tempfile
+import weakref
 import kestrel
 import kestrel_datasource_stixshifter
 import pandas as pd
@@ -259,6 +261,29 @@ def test_session_runtime_dir():
     assert os.path.exists(d)
 
 
+def test_session_cleanup_without_close():
+    session = Session()
+    runtime_directory = session.runtime_directory
+    assert os.path.exists(runtime_directory)
+    del session
+    gc.collect()
+    assert not os.path.exists(runtime_directory)
+
+
+def test_session_released_after_deref():
+    session = Session()
+    # WHERE with a reference: deref functions are built for the statement
+    execute(session, 'x = NEW process [{"pid": 1, "ppid": 2}]')
+    execute(session, "y = x WHERE pid = x.pid")
+    store_ref = weakref.ref(session.store)
+    symtable_ref = weakref.ref(session.symtable)
+    session.close()
+    del session
+    gc.collect()
+    assert store_ref() is None
+    assert symtable_ref() is None
+
+
 @pytest.mark.parametrize(
     "time_string, suffix_ts",
     [
@@ -268,6 +293,9 @@ def test_session_runtime_dir():
         ("START t'2021-05-04T07:", ["00:00Z'"]),
         ("START t'2021-05-04T07:30", [":00Z'"]),
         ("START t'2021-05-04T07:30:", ["00Z'"]),
+        ("START t'2021-05-04T07", [":00:00Z'"]),
+        ("START t'2021-05-04T07:30:00", ["Z'"]),
+        ("START t'2021-13", None),
         ("STOP t'2021", ["-01-01T00:00:00Z'"]),
         ("STOP t'2021-05", ["-01T00:00:00Z'"]),
         ("STOP t'2021-05-04", ["T00:00:00Z'"]),